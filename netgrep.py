@@ -7,8 +7,17 @@ __author__ = "Phillip Stansell"
 __version__ = "0.92"
 
 import argparse
+import functools
+import io
 import ipaddress
+import mmap
+import os
+import pathlib
+import re
+import socket
 import sys
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
 try:
     import colorama
 except ImportError:
@@ -16,36 +25,140 @@ except ImportError:
 else:
     COLORAMA_IMPORTED = True
     from colorama import Fore, Style
+    # Sequences wrapped around every matched token, resolved once
+    _BRIGHT_RED = Style.BRIGHT + Fore.RED
+    _RESET = Style.RESET_ALL
+try:
+    import pytricia
+except ImportError:
+    PYTRICIA_IMPORTED = False
+else:
+    PYTRICIA_IMPORTED = True
 
+# Characters an address or network string can start with, and its shape: an
+# address, an optional IPv6 scope and an optional prefix or mask
+_IP_FIRST_CHARS = frozenset("0123456789ABCDEFabcdef:")
+_IP_CANDIDATE = re.compile(r"[0-9A-Fa-f:.]+(?:%[^/%]+)?(?:/[0-9.]+)?")
 
-def _build_output_line(parts: dict, colorize: bool) -> str:
-    """
-    Take a dictionary with the following keys:
-        'file_name': str
-        'line_number': int
-        'line_tokens': list of str
-        'matched_tokens': list of int
+# Prefix lengths of every IPv4 netmask and hostmask as an int. A mask valid as
+# both, such as 0.0.0.0, is read as a netmask like ipaddress does.
+_MASK_TO_PREFIX = {int(ipaddress.IPv4Network((0, p)).netmask): p
+        for p in range(33)}
+_HOSTMASK_TO_PREFIX = {int(ipaddress.IPv4Network((0, p)).hostmask): p
+        for p in range(33)}
 
-    A string that combines these components is returned. If 'colorize' is True,
-    some elements are nicely colorized in the string.
-    """
-    sep = ":"
-    if colorize and COLORAMA_IMPORTED:
-        sep = Fore.CYAN + sep + Style.RESET_ALL
-        parts["file_name"] = Fore.MAGENTA + parts["file_name"] + Style.RESET_ALL
-        parts["line_number"] = Fore.GREEN + str(parts["line_number"]) + Style.RESET_ALL
-        for match in parts["matched_tokens"]:
-            parts["line_tokens"][match] = ( Style.BRIGHT +
-                    Fore.RED +
-                    parts["line_tokens"][match] +
-                    Style.RESET_ALL )
+# Patterns every IPv4 and IPv6 address or network contains, used to find lines
+# worth decoding and tokenizing. Groups are bounded to the longest valid octet
+# or hextet, so long runs of digits cannot make the search backtrack.
+_IPV4_LINE_CANDIDATE = rb"[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}"
+_IPV6_LINE_CANDIDATE = rb":[0-9A-Fa-f]{0,4}:"
+
+# Size of the blocks target files that cannot be mapped are read and scanned in,
+# and of the slices line breaks are counted in
+_CHUNK_SIZE = 1 << 22
 
-    result = "{fn}{sp}{ln}{sp}{li}".format(fn=parts["file_name"],
-            ln=parts["line_number"],
-            li=" ".join(parts["line_tokens"]),
+# IPv4 index, IPv6 index of a _search_files() worker process, set by
+# _init_search_worker()
+_worker_indexes = ()
+
+
+def _build_colored_line(file_name: str, line_number: int, line: str,
+        matched_tokens: tuple) -> str:
+    """
+    Take a file name, a line number, a line and the indexes of the matched
+    tokens of the line. Return an output line combining these components with
+    some elements nicely colorized. The line is rebuilt from its tokens.
+    Requires colorama.
+    """
+    sep = Fore.CYAN + ":" + _RESET
+    # Wrap matched tokens while joining them
+    matched = set(matched_tokens)
+
+    return "{fn}{sp}{ln}{sp}{li}".format(fn=Fore.MAGENTA + file_name + _RESET,
+            ln=Fore.GREEN + str(line_number) + _RESET,
+            li=" ".join(_BRIGHT_RED + token + _RESET if i in matched else token
+                for i, token in enumerate(line.split())),
             sp=sep)
 
-    return result
+def _build_index(networks: list, max_prefixlen: int) -> dict:
+    """
+    Take a list of networks of a single address family and the address length
+    in bits of that family. Return a dictionary with the following keys:
+        'networks': list of IPv4Network or IPv6Network
+        'starts': sorted list of int, first address of each range of addresses
+            covered by the networks
+        'ends': list of int, last address of each range in 'starts' order
+        'trie': PyTricia holding every network, or None if the 'pytricia'
+            module is not installed
+    """
+    starts = []
+    ends = []
+
+    # Merge networks into disjoint ranges in one pass over them in address
+    # order, extending the last range for every network that overlaps or
+    # adjoins it
+    for start, end in sorted((int(net.network_address),
+            int(net.broadcast_address)) for net in networks):
+        if ends and start <= ends[-1] + 1:
+            if end > ends[-1]:
+                ends[-1] = end
+        else:
+            starts.append(start)
+            ends.append(end)
+
+    trie = None
+    if PYTRICIA_IMPORTED:
+        trie = pytricia.PyTricia(max_prefixlen)
+        for net in networks:
+            trie.insert(str(net), True)
+
+    return {"networks": networks,
+            "starts": starts,
+            "ends": ends,
+            "trie": trie}
+
+def _build_plain_line(file_name: str, line_number: int, line: str,
+        matched_tokens: tuple) -> str:
+    """
+    Take the same arguments as _build_colored_line(). Return an output line
+    combining the file name, line number and the line as read.
+    """
+    return "{}:{}:{}".format(file_name, line_number, line)
+
+def _candidate_lines(chunk, pattern):
+    """
+    Take a bytes-like object of whole lines, such as bytes or an mmap, and a
+    compiled bytes pattern. Scan the object for the pattern in one pass,
+    yielding a tuple of the line's index within the object and the line decoded
+    without its line ending for each line with a match. Lines end in "\n",
+    "\r\n" or a bare "\r", as when reading the file in text mode.
+    """
+    # Start of the line 'line_index' refers to
+    pos = 0
+    line_index = 0
+
+    # Most files have no "\r" at all, skip looking for it on every match then
+    carriage_returns = chunk.find(b"\r") >= 0
+
+    match = pattern.search(chunk)
+    while match is not None:
+        start = chunk.rfind(b"\n", 0, match.start()) + 1
+        end = chunk.find(b"\n", match.end())
+        if end < 0:
+            end = len(chunk)
+        # Only look for a bare "\r" within the "\n" terminated line
+        if carriage_returns:
+            start = max(start, chunk.rfind(b"\r", start, match.start()) + 1)
+            carriage_return = chunk.find(b"\r", match.end(), end)
+            if carriage_return >= 0:
+                end = carriage_return
+
+        line_index += _count_line_breaks(chunk, pos, start, carriage_returns)
+        pos = start
+        yield line_index, chunk[start:end].decode("utf-8", "replace")
+
+        # Continue after the line, one match is enough
+        match = pattern.search(chunk, end)
 
 def _clean_up_networks(strings: list) -> tuple:
     """
@@ -53,7 +166,7 @@ def _clean_up_networks(strings: list) -> tuple:
     class. For elements that fail conversion (still string), print an error and
     remove them. Separate remaining items into lists of a single address family:
     one of IPv4 objects and the other of IPv6 objects. Return a tuple of the
-    IPv4Network list, IPv6Network list.
+    IPv4 index, IPv6 index as built by _build_index().
     """
 
     # Get two empty lists ready
@@ -65,151 +178,427 @@ def _clean_up_networks(strings: list) -> tuple:
 
     # Print an error for each string that did not convert and remove it from
     # the list. Sort IPv4 and IPv6 objects into separate lists.
-    for i,item in enumerate(ip_networks):
-        if isinstance(item, str):
+    for i,(tag, item) in enumerate(ip_networks):
+        if tag == 0:
             print("ValueError: '{}' does not appear to be an IPv4 or IPv6 "
                     "network, ignoring.".format(item))
             del ip_networks[i]
-        elif isinstance(item, ipaddress.IPv4Network):
+        elif tag == 4:
             ip4_nets.append(item)
-        elif isinstance(item, ipaddress.IPv6Network):
+        elif tag == 6:
             ip6_nets.append(item)
         else:
             raise TypeError("Unexpected type for item {} found at "
             "'ip_networks[{}]'.".format(str(item), i))
 
-    # Return collapsed lists
-    return (list(ipaddress.collapse_addresses(ip4_nets)),
-            list(ipaddress.collapse_addresses(ip6_nets)))
+    # Return indexes of the lists
+    return (_build_index(ip4_nets, 32), _build_index(ip6_nets, 128))
+
+def _close_output(out):
+    """
+    Take a text stream returned by _open_output(). Flush it, and detach it from
+    standard output without closing standard output.
+    """
+    out.flush()
+    if out is not sys.stdout:
+        out.detach().detach()
+
+def _count_line_breaks(chunk, start: int, end: int,
+        carriage_returns: bool = True) -> int:
+    """
+    Take a bytes-like object, such as bytes or an mmap, and a start and end
+    offset that do not split a "\r\n". Return the number of line breaks
+    between the offsets, counting "\n", "\r\n" and a bare "\r" as one each.
+    If 'carriage_returns' is False, the object is known to hold no "\r" and
+    only "\n" is counted. An mmap has no count(), so slices are counted, each
+    about _CHUNK_SIZE long to avoid copying a large part of a mapped file at
+    once.
+    """
+    result = 0
+
+    pos = start
+    while pos < end:
+        # Extend the slice rather than split a "\r\n" between two slices
+        stop = min(pos + _CHUNK_SIZE, end)
+        if chunk[stop - 1:stop] == b"\r" and chunk[stop:stop + 1] == b"\n":
+            stop += 1
+
+        piece = chunk[pos:stop]
+        result += piece.count(b"\n")
+        if carriage_returns:
+            result += piece.count(b"\r") - piece.count(b"\r\n")
+        pos = stop
+
+    return result
+
+def _init_search_worker(ipv4_networks: list, ipv6_networks: list):
+    """
+    Take the IPv4Network list and IPv6Network list. Build the indexes
+    searched by _search_worker() in this worker process. Indexes are rebuilt
+    rather than passed in, as a PyTricia cannot be pickled.
+    """
+    global _worker_indexes
+    _worker_indexes = (_build_index(ipv4_networks, 32),
+            _build_index(ipv6_networks, 128))
+
+def _match_ints(token_ints: list, starts: list, ends: list) -> list:
+    """
+    Take a list of (first address, last address) int pairs and the 'starts' and
+    'ends' values of an index as built by _build_index(). Return a list of
+    bools, True where the pair at the same position is within a network of the
+    index.
+    """
+    result = []
+
+    for token_start, token_end in token_ints:
+        # Find the last network starting at or before the token. As the
+        # networks are disjoint, it is the only one that can hold the token.
+        idx = bisect_right(starts, token_start) - 1
+        result.append(idx >= 0 and token_end <= ends[idx])
+
+    return result
+
+def _open_output(colorize: bool):
+    """
+    Return a text stream writing to standard output through a 1 MiB buffer,
+    so output is not flushed line by line when going to a terminal. When
+    colorizing, sys.stdout is returned as is, as colorama may have wrapped it to
+    translate colors. Release the stream with _close_output().
+    """
+    if colorize:
+        return sys.stdout
+
+    # Keep anything already printed ahead of the new stream's output
+    sys.stdout.flush()
+
+    return io.TextIOWrapper(io.BufferedWriter(sys.stdout.buffer,
+            buffer_size=1 << 20),
+            encoding=sys.stdout.encoding,
+            errors=sys.stdout.errors)
+
+def _parse_network(string: str):
+    """
+    Take a string and return it converted to an object of type IPv4Network or
+    IPv6Network, or None if it could not be converted.
+    """
+    # Skip strings that cannot hold an address without paying for a failed
+    # parse
+    if (not string or string[0] not in _IP_FIRST_CHARS
+            or _IP_CANDIDATE.fullmatch(string) is None):
+        return None
+
+    # Bare addresses are converted by the C library, which is far cheaper than
+    # ipaddress parsing the string. Strict inet_pton() is used as inet_aton()
+    # accepts shorthand such as "10.1" that ipaddress rejects. It rejects
+    # scoped addresses, so those go to ipaddress directly.
+    if "/" not in string and "%" not in string:
+        try:
+            if ":" in string:
+                return ipaddress.IPv6Network(int.from_bytes(
+                    socket.inet_pton(socket.AF_INET6, string), "big"))
+            return ipaddress.IPv4Network(int.from_bytes(
+                socket.inet_pton(socket.AF_INET, string), "big"))
+        except (OSError, ValueError):
+            pass
+
+    try:
+        network = ipaddress.ip_network(string)
+    except ValueError:
+        # Without a prefix, a string that is not a network is not an interface
+        # either
+        if "/" not in string:
+            return None
+        try:
+            network = ipaddress.ip_interface(string).network
+        except ValueError:
+            return None
+
+    # Matching ignores IPv6 scopes such as "%eth0". Drop the scope, as
+    # ipaddress cannot explode a scoped address for the trie.
+    if "%" in string:
+        network = ipaddress.IPv6Network((int(network.network_address),
+            network.prefixlen))
+
+    return network
+
+def _read_chunks(file):
+    """
+    Take a file open in binary mode. Yield tuples of the number of the first
+    line and a bytes-like object holding whole lines only. A file that can be
+    memory mapped is yielded whole as an mmap, so it is never copied or decoded
+    as a whole. Others are read in bytes of about _CHUNK_SIZE.
+    """
+    try:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # Empty files, pipes and the like cannot be mapped
+        pass
+    else:
+        with mapped:
+            yield 1, mapped
+        return
+
+    line_number = 1
+    remainder = b""
+
+    while True:
+        block = file.read(_CHUNK_SIZE)
+
+        # Empty block indicates EOF, the last line may lack a line ending
+        if not block:
+            if remainder:
+                yield line_number, remainder
+            return
+
+        # Hold back a partial last line for the next chunk. A trailing "\r" is
+        # held back too, as the next block may start with its "\n".
+        chunk = remainder + block
+        last = len(chunk) - 1 if chunk.endswith(b"\r") else len(chunk)
+        cut = max(chunk.rfind(b"\n", 0, last), chunk.rfind(b"\r", 0, last)) + 1
+        remainder = chunk[cut:]
+        if cut:
+            yield line_number, chunk[:cut]
+            line_number += _count_line_breaks(chunk, 0, cut)
 
 def _read_networks_files(file_list: list) -> list:
     """
-    Take a list of file names. Read each line from all files into a list.
-    Return the list.
+    Take a list of file names. Read each non-empty line from all files into a
+    list. Return the list.
     """
     network_strings = []
 
-    # Read network list from files
+    # Read network list from files, each in a single read
     for net_file in file_list:
         try:
-            net_f = open(net_file, "r")
+            lines = pathlib.Path(net_file).read_text().splitlines()
         except OSError:
             print("Could not open file '{}', skipping.".format(net_file), file=sys.stderr)
         else:
-            while True:
-                # Read the next line of the file
-                line = net_f.readline()
-
-                # Empty line indicates EOF
-                if not line:
-                    break
-
-                # Add non-empty lines to the list with the new line stripped
-                network_strings.append(line.strip("\n"))
+            # Add non-empty lines to the list, line endings are already removed
+            network_strings.extend(line for line in lines if line)
 
     return network_strings
 
-def _search_files(files: list, ipv4_networks: list, ipv6_networks: list, colorize: bool):
+def _search_files(files: list, ipv4_index: dict, ipv6_index: dict, colorize: bool):
     """
     Take a list of file names. For each file search for matches to the network
-    list. Print any lines with at least one match.
+    list. Print any lines with at least one match. Multiple files are searched
+    in parallel worker processes, output is printed in file order.
     """
-    for target in files:
-        try:
-            target_file = open(target, "r")
-        except OSError:
-            print("Could not open file '{}', skipping.".format(target))
-        else:
-            count = 0
-
-            # Process lines in the file
-            while True:
-                count +=1
-
-                # Get next line from file
-                line = target_file.readline()
-
-                # If line is empty end of file is reached
-                if not line:
-                    break
-
-                # Tokenize the line
-                line_tokens = line.strip("\n").split(" ")
-                # Get indexes from line_tokens that are within an element of
-                # ip_networks
-                matches = _search_tokens(line_tokens, ipv4_networks, ipv6_networks)
-                # If we found a match, print the line
-                if len(matches) > 0:
-                    print(_build_output_line({"file_name": target,
-                        "line_number": count,
-                        "line_tokens": line_tokens,
-                        "matched_tokens": matches}, colorize))
-        finally:
-            # Close opened file
-            target_file.close()
-
-def _search_tokens(tokens: list, ipv4_networks: list, ipv6_networks: list) -> list:
-    """
-    Take a list of strings, a list of IPv4Network objects, and a list of
-    IPv6Network objects. Return a list of indexes from the first list that were
-    found within a network from the second or third list.
+    out = _open_output(colorize)
+    try:
+        # A single worker is not worth the cost of starting worker processes
+        max_workers = min(len(files), os.cpu_count() or 1)
+        if max_workers == 1:
+            for target in files:
+                lines = _search_one_file(target, ipv4_index, ipv6_index, colorize)
+                if lines:
+                    out.write("\n".join(lines) + "\n")
+            return
+
+        with ProcessPoolExecutor(max_workers=max_workers,
+                initializer=_init_search_worker,
+                initargs=(ipv4_index["networks"], ipv6_index["networks"])) as executor:
+            for lines in executor.map(functools.partial(_search_worker,
+                    colorize=colorize), files):
+                # Write all lines of a file at once
+                if lines:
+                    out.write("\n".join(lines) + "\n")
+    finally:
+        _close_output(out)
+
+def _search_line(line: str, ipv4_index: dict, ipv6_index: dict,
+        any_match: bool) -> tuple:
+    """
+    Take a line, an IPv4 index and an IPv6 index as built by _build_index(), and
+    the 'any_match' argument of _search_tokens(). Return a tuple of the
+    indexes of the line's tokens found within a network of the indexes, a tuple
+    so cached results cannot be changed.
+    """
+    # Tokenize the line on any run of whitespace, which also drops empty tokens
+    line_tokens = line.split()
+    # Get indexes from line_tokens that are within an element of ip_networks
+    return tuple(_search_tokens(line_tokens, ipv4_index, ipv6_index, any_match))
+
+def _search_one_file(target: str, ipv4_index: dict, ipv6_index: dict, colorize: bool) -> list:
+    """
+    Take a file name, an IPv4 index and an IPv6 index as built by
+    _build_index(). Search the file for matches to the indexes. Return a list
+    of output lines, one for each line with at least one match.
     """
     result = []
-    # Convert tokens to IPv4Network or IPv6Network objects
-    ip_tokens = _strings_to_networks(tokens)
-
-    # If any token has converted to an ipaddress object, check if it is a
-    # subnet of any member of the matching address family list. For sucessful
-    # subnet matches, add the ip_token list index to the result list.
-    for i, token in enumerate(ip_tokens):
-        if isinstance(token, ipaddress.IPv4Network):
+
+    # Pick how output lines are built once for the file, rather than on every
+    # match. Without colors, the first match of a line is enough.
+    build_line = functools.partial(
+            _build_colored_line if colorize else _build_plain_line, target)
+    any_match = not colorize
+
+    # Files tend to repeat lines, search recently seen lines once. Only the
+    # match indexes are cached and the cache is kept small, as on files of
+    # mostly unique lines it costs memory and time. The indexes do not change
+    # while searching, so a line's result stays valid.
+    search_line = functools.lru_cache(maxsize=1 << 12)(functools.partial(
+            _search_line, ipv4_index=ipv4_index, ipv6_index=ipv6_index,
+            any_match=any_match))
+
+    # Only look for address families that have networks to match
+    candidates = []
+    if ipv4_index["starts"]:
+        candidates.append(_IPV4_LINE_CANDIDATE)
+    if ipv6_index["starts"]:
+        candidates.append(_IPV6_LINE_CANDIDATE)
+    pattern = re.compile(b"|".join(candidates)) if candidates else None
+
+    try:
+        target_file = open(target, "rb")
+    except OSError:
+        # Returned rather than printed to keep it in order with the output of
+        # other files
+        result.append("Could not open file '{}', skipping.".format(target))
+    else:
+        # Scan the raw bytes of the file, closing it once it is exhausted
+        with target_file:
+            if pattern is None:
+                return result
+
+            for count, chunk in _read_chunks(target_file):
+                # Only lines holding a candidate are decoded, tokenized and
+                # searched
+                for offset, line in _candidate_lines(chunk, pattern):
+                    matches = search_line(line)
+                    # If we found a match, keep the line
+                    if len(matches) > 0:
+                        result.append(build_line(count + offset, line, matches))
+
+    return result
+
+def _search_tokens(tokens: list, ipv4_index: dict, ipv6_index: dict,
+        any_match: bool = False) -> list:
+    """
+    Take a list of strings, an IPv4 index and an IPv6 index as built by
+    _build_index(). Return a list of indexes from the first list that were
+    found within a network from the second or third argument. If 'any_match'
+    is True, return as soon as one index is found, with only that index.
+    """
+    result = []
+    last = len(tokens) - 1
+
+    # Resolve names used for every token once instead of inside the loop
+    IPv4Network = ipaddress.IPv4Network
+    ipv4_starts, ipv4_ends, ipv4_trie = (ipv4_index["starts"],
+            ipv4_index["ends"], ipv4_index["trie"])
+    ipv6_starts, ipv6_ends, ipv6_trie = (ipv6_index["starts"],
+            ipv6_index["ends"], ipv6_index["trie"])
+
+    # Positions of tokens not settled by a trie, and their first and last
+    # addresses as ints
+    ipv4_positions, ipv4_ints = [], []
+    ipv6_positions, ipv6_ints = [], []
+
+    # Network replacing the next token, set by the mask lookahead
+    next_network = None
+
+    # Convert tokens to IPv4Network or IPv6Network objects as they are reached,
+    # so returning early skips converting the rest. If a token has converted,
+    # check if it is a subnet of any member of the matching address family
+    # index. For sucessful subnet matches, add the token index to the result
+    # list.
+    for i, string in enumerate(tokens):
+        if next_network is None:
+            tag, token = _string_to_network(string)
+        else:
+            tag, token, next_network = 4, next_network, None
+
+        # Dispatch on the address family tag, an int compare
+        if tag == 4:
             # For host length networks, look ahead to the next token. If that
             # is a subnet mask or host mask, replace both tokens with the
             # corrected network.
-            if token.prefixlen == 32 and (i + 1) < len(ip_tokens):
-                j = i + 1
-                next_token = ip_tokens[j]
-                if isinstance(next_token, ipaddress.IPv4Network) and next_token.prefixlen == 32:
-                    new_token = _strings_to_networks([ str(token.network_address)
-                        + "/"
-                        + str(next_token.network_address) ])[0]
-                    if isinstance(new_token, ipaddress.IPv4Network):
-                        token = new_token
-                        ip_tokens[j] = new_token
-
-            # Check if IPv4Network object is subnet of any ipv4_networks list
-            # member. Break the loop on first match.
-            for net in ipv4_networks:
-                if token.subnet_of(net):
-                    # print("Token {} matched network {}.".format(token, net))
-                    result.append(i)
-                    break
-        elif isinstance(token, ipaddress.IPv6Network):
-            # Check if IPv6Network object is subnet of any ipv6_networks list
-            # member. Break the loop on first match.
-            for net in ipv6_networks:
-                if token.subnet_of(net):
-                    result.append(i)
-                    break
+            if token.prefixlen == 32 and i < last:
+                next_tag, next_token = _string_to_network(tokens[i + 1])
+                if next_tag == 4 and next_token.prefixlen == 32:
+                    mask = int(next_token.network_address)
+                    prefixlen = _MASK_TO_PREFIX.get(mask)
+                    if prefixlen is None:
+                        prefixlen = _HOSTMASK_TO_PREFIX.get(mask)
+                    if prefixlen is not None:
+                        token = IPv4Network((int(token.network_address),
+                            prefixlen), strict=False)
+                        next_network = token
+
+            starts, ends, trie = ipv4_starts, ipv4_ends, ipv4_trie
+            positions, ints = ipv4_positions, ipv4_ints
+        elif tag == 6:
+            starts, ends, trie = ipv6_starts, ipv6_ends, ipv6_trie
+            positions, ints = ipv6_positions, ipv6_ints
+        else:
+            continue
+
+        # Host length tokens are looked up in the trie, when available
+        if trie is not None and token.prefixlen == token.max_prefixlen:
+            if token.network_address.exploded in trie:
+                if any_match:
+                    return [i]
+                result.append(i)
+            continue
+
+        token_start = int(token.network_address)
+        token_end = int(token.broadcast_address)
+        # When any match will do, settle each token as it is reached, as
+        # _match_ints() does but without building lists for a single token
+        if any_match:
+            idx = bisect_right(starts, token_start) - 1
+            if idx >= 0 and token_end <= ends[idx]:
+                return [i]
+            continue
+        positions.append(i)
+        ints.append((token_start, token_end))
+
+    # Match the remaining tokens of each address family in one pass
+    if ipv4_ints:
+        result.extend(i for i, matched in zip(ipv4_positions,
+                _match_ints(ipv4_ints, ipv4_starts, ipv4_ends)) if matched)
+    if ipv6_ints:
+        result.extend(i for i, matched in zip(ipv6_positions,
+                _match_ints(ipv6_ints, ipv6_starts, ipv6_ends)) if matched)
+    result.sort()
 
     return result
 
+def _search_worker(target: str, colorize: bool) -> list:
+    """
+    Take a file name. Search it with the indexes of this worker process and
+    return the output lines of _search_one_file().
+    """
+    return _search_one_file(target, *_worker_indexes, colorize)
+
+@functools.lru_cache(maxsize=65536)
+def _string_to_network(string: str) -> tuple:
+    """
+    Take a string and return a tuple of an address family tag and the string
+    converted by _parse_network(). The tag is 4 or 6 for an IPv4Network or
+    IPv6Network, or 0 with None if the string could not be converted. Results
+    are cached as the same addresses tend to repeat throughout a file.
+    """
+    network = _parse_network(string)
+    if network is None:
+        return (0, None)
+
+    return (network.version, network)
+
 def _strings_to_networks(strings: list) -> list:
     """
-    Take a list of strings and return a list with elements converted to objects
-    of type IPv4Network or IPv6Network where possible. Strings that could not be
-    converted are copied unchanged.
+    Take a list of strings and return a list of tuples of an address family tag
+    and the element converted to an object of type IPv4Network or IPv6Network
+    where possible, as returned by _string_to_network(). Strings that could not
+    be converted are copied unchanged, with tag 0.
     """
     result = []
 
     for item in strings:
-        try:
-            result.append(ipaddress.ip_network(item))
-        except ValueError:
-            try:
-                result.append(ipaddress.ip_interface(item).network)
-            except ValueError:
-                result.append(item)
+        tag, network = _string_to_network(item)
+        result.append((tag, item if network is None else network))
 
     return result
 
@@ -266,15 +655,15 @@ def main():
         target_files = args.target_files
 
     # Convert network strings to ipaddress objects
-    ipv4_networks, ipv6_networks = _clean_up_networks(network_strings)
+    ipv4_index, ipv6_index = _clean_up_networks(network_strings)
 
     # print("network_strings: {}".format(network_strings))
     # print("target_files: {}".format(target_files))
-    # print("ipv4_networks: {}".format(ipv4_networks))
-    # print("ipv6_networks: {}".format(ipv6_networks))
+    # print("ipv4_networks: {}".format(ipv4_index["networks"]))
+    # print("ipv6_networks: {}".format(ipv6_index["networks"]))
 
     # Process each target file
-    _search_files(target_files, ipv4_networks, ipv6_networks, colorize)
+    _search_files(target_files, ipv4_index, ipv6_index, colorize)
 
 if __name__ == "__main__":
     main()
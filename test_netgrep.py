@@ -0,0 +1,83 @@
+"""Regression tests for netgrep.py.
+"""
+
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import netgrep
+
+
+class SearchOneFileTest(unittest.TestCase):
+
+    def _search(self, contents: bytes, networks: list, colorize: bool = False) -> list:
+        """
+        Write 'contents' to a temporary file and search it for 'networks'.
+        Return the output lines with the temporary file name replaced by
+        "target".
+        """
+        with tempfile.NamedTemporaryFile(delete=False) as target_file:
+            target_file.write(contents)
+        self.addCleanup(os.remove, target_file.name)
+
+        ipv4_index, ipv6_index = netgrep._clean_up_networks(networks)
+        lines = netgrep._search_one_file(target_file.name, ipv4_index,
+                ipv6_index, colorize)
+
+        return [line.replace(target_file.name, "target", 1) for line in lines]
+
+    def test_long_digit_run(self):
+        # A long run of digits must not make the candidate search backtrack
+        contents = b"1" * 200000 + b"\n10.0.0.1\n"
+
+        start = time.monotonic()
+        lines = self._search(contents, ["10.0.0.0/8"])
+
+        self.assertEqual(lines, ["target:2:10.0.0.1"])
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_scoped_ipv6(self):
+        # Scoped addresses match on the address, whatever the scope
+        contents = b"x fe80::1%eth0 y\nfe80::2%eth0/64\n2001:db8::1%eth0\n"
+
+        lines = self._search(contents, ["fe80::/10"])
+
+        self.assertEqual(lines, ["target:1:x fe80::1%eth0 y",
+                "target:2:fe80::2%eth0/64"])
+
+        # Any scope text is accepted, including a NUL byte
+        contents = b"x 1.2.3.4%\x00y\nfe80::1%\x00\n10.0.0.1\n"
+
+        lines = self._search(contents, ["10.0.0.0/8", "fe80::/10"])
+
+        self.assertEqual(lines, ["target:2:fe80::1%\x00", "target:3:10.0.0.1"])
+
+    def test_line_numbers_across_count_slices(self):
+        # Newlines between matches are counted in slices of _CHUNK_SIZE
+        contents = b"".join(b"line %d\n" % i for i in range(1, 100)) + b"10.0.0.1\n"
+
+        with mock.patch.object(netgrep, "_CHUNK_SIZE", 7):
+            lines = self._search(contents, ["10.0.0.0/8"])
+
+        self.assertEqual(lines, ["target:100:10.0.0.1"])
+
+    def test_carriage_return_line_breaks(self):
+        # "\r\n" and a bare "\r" end lines, as in text mode, both when the
+        # file is mapped and when it is read in chunks of any size
+        contents = b"10.0.0.1 a\r\nb\r10.0.0.2\rc\n\r\r\n10.0.0.3\r"
+        expected = ["target:1:10.0.0.1 a", "target:3:10.0.0.2",
+                "target:7:10.0.0.3"]
+
+        self.assertEqual(self._search(contents, ["10.0.0.0/8"]), expected)
+
+        for chunk_size in (1, 2, 3, 5, 11):
+            with mock.patch.object(netgrep, "_CHUNK_SIZE", chunk_size), \
+                    mock.patch.object(netgrep.mmap, "mmap", side_effect=OSError):
+                self.assertEqual(self._search(contents, ["10.0.0.0/8"]),
+                        expected, chunk_size)
+
+
+if __name__ == "__main__":
+    unittest.main()